@@ -5,190 +5,272 @@ An implementation of a consistent hash ring from scratch. It is effectively a wr
 tree with its own unique method of lookup. The consistent hash ring only exposes the server's name - applications
 are responsible for actually fetching the data from the server.
 
-The binary search tree implementation here exposes a convenient API around fetches, updates and insertions. 
+The ring keeps its values in a sorted array of keys, so that finding the best match is a single binary search
+rather than a walk over a tree's nodes. A balanced binary search tree is only built from that array when it is
+asked for.
 '''
 
+from bisect import bisect_left
+from operator import itemgetter
+
+def _rendezvous_score(node_key, key):
+
+    '''
+    Mixes the ring key of a candidate value with the key being looked up into a 64 bit rendezvous (HRW) score.
+    This only uses integer arithmetic on the two keys, so scores are exactly as stable across runs as the ring's
+    hash function is. The final steps are the MurmurHash3 finaliser, which spreads every input bit across the score.
+    '''
+
+    mask = 0xFFFFFFFFFFFFFFFF
+
+    score = (node_key * 0x9E3779B97F4A7C15 ^ key) & mask
+    score = ((score ^ (score >> 33)) * 0xFF51AFD7ED558CCD) & mask
+    score = ((score ^ (score >> 33)) * 0xC4CEB9FE1A85EC53) & mask
+
+    return score ^ (score >> 33)
+
 class SubTree(object):
 
     '''
     A class that implements a subtree in our binary search tree. This subtree can be either
     a node, a node with leaf nodes, or a node with other other subtrees as children. 
     
-    Methods for removal and insertion are defined here. Lookup is not provided as we only 
-    care about that when we have access to a dedicated root node. 
+    Trees are built in one go from sorted values by from_sorted, and are only a view of the
+    values in a ring - the ring itself is changed through ConsistentHashRing.add_node and
+    remove_node. Lookup is not provided as the ring searches its sorted keys instead.
     '''
 
-    def __init__(self, value, left=None, right=None):
+    __slots__ = ('value', 'key', 'left', 'right')
+
+    def __init__(self, value, left=None, right=None, key=None):
 
         '''
-        @param: value [Any]: The raw value you wish to insert. Must implement comparison.
-        @param: left, right [Node]: Left and right children of this node.
+        @param: value [Any]: The raw value you wish to insert.
+        @param: left, right [SubTree]: Left and right children of this node.
+        @param: key [int]: The ring position of value, as computed by the ring's hash function. Required.
         '''
 
-        self.value, self.key = value, hash(value)
+        if key is None:
+            raise TypeError("SubTree requires the key of its value, as computed by the ring's hash function")
+
+        self.value, self.key = value, key
         self.left, self.right = left, right
 
-    def add_child(self, value):
+    @classmethod
+    def from_sorted(cls, values, keys):
 
-        ''' 
-        Recursively add a child node with the defined value.
-        Duplicate values are excluded in this tree.
         '''
+        Build a balanced tree from values already sorted by their keys, which must be unique. Returns the root
+        node, or None if there are no values.
 
-        key = hash(value)
+        Each subtree is rooted at the middle value of its range, so no path is longer than log2(n) + 1 nodes.
+        Ranges still to be built are kept on an explicit stack rather than recursed into.
+        '''
 
-        if key == self.key:
-           return 
+        root, stack = None, [(0, len(values), None, False)]
 
-        if key > self.key:
+        while stack:
 
-            if self.right is None:
-                self.right = SubTree(value)
-            else:
-                self.right.add_child(value)
+            low, high, parent, is_left_child = stack.pop()
 
-        if key < self.key:
+            if low >= high:
+                continue
 
-            if self.left is None:
-                self.left = SubTree(value)
+            middle = (low + high) // 2
+            new_node = cls(values[middle], key=keys[middle])
+
+            if parent is None:
+                root = new_node
+            elif is_left_child:
+                parent.left = new_node
             else:
-                self.left.add_child(value)
+                parent.right = new_node
+
+            stack.append((low, middle, new_node, True))
+            stack.append((middle + 1, high, new_node, False))
+
+        return root
+
+    def __repr__(self):
+        return "Node(value={0}, right={1}, left={2})".format(self.value, self.right, self.left)
+
+    def __str__(self):
+        return self.__repr__()
+
+    def __contains__(self, value):
+
+        # the tree cannot hash value itself without risking a different hash function to the ring's
+        raise TypeError("SubTree membership is checked by key - use contains_key(key), or 'value in ring'")
 
-    def _find_minimum_subtree_child_value(self):
+    def contains_key(self, key):
 
         '''
-        A helper method that seeks to find the minimum value in the subtree
-        this node acts as the root for. It does so by simply finding the leftmost 
-        node in the tree.
+        Whether a value with this key is held in the subtree. Membership is checked by key rather than value, 
+        as only the ring knows which hash function its keys came from.
         '''
 
         current_node = self
 
-        while current_node.left is not None:
-            current_node = current_node.left
-
-        return current_node.value
+        while current_node is not None:
 
-    def _find_in_order_successor(self):
+            if key == current_node.key:
+                return True
 
-        '''
-        A helper method to obtain the in-order successor of a particular node.
+            current_node = current_node.right if key > current_node.key else current_node.left
 
-        Typical implementations take into account the possibility that a parent
-        node be the next in-order successor - but in our case, this method is only
-        called when the right subtree is well-defined, in which case the in-order 
-        successor is never a parent.
-        '''
+        return False
 
-        if self.right is None:
-            return None
+    def __iter__(self):
 
-        return self.right._find_minimum_subtree_child_value()
+        # in-order traversal using an explicit stack of the nodes still to be visited
+        stack, current_node = [], self
 
-    def remove_value(self, value):
+        while stack or current_node is not None:
 
-        '''
-        Removes a value from this node and its subtree. Returns the new node that should take 
-        the place of the node that was removed.
-        '''
+            while current_node is not None:
+                stack.append(current_node)
+                current_node = current_node.left
 
-        key = hash(value)
+            current_node = stack.pop()
+            yield current_node.value
+            current_node = current_node.right
 
-        if key == self.key:
 
-            # if leaf node, remove oneself
-            if self.left is None and self.right is None:
-                return None
+class ConsistentHashRing(object):
 
-            # the following two cases return whichever child node is extant
-            # for a one-child parent.
+    ''' 
+    A consistent hash ring that lets you manipulate the whole ring at once.
 
-            if self.left is None and self.right is not None:
-                return self.right
+    This class enables you to search the ring for the closest match to a value, and provides 
+    access to the root node of a SubTree holding its values. Iteration and length methods 
+    return all stored values in the ring, however.
 
-            if self.right is None and self.left is not None:
-                return self.left
-            
-            # case where neither left or right child is empty
-            if self.right is not None and self.left is not None:
+    Values added to this ConsistentHashRing _must_ be hashable. 
 
-                # copy the value of the first in-order successor, 
-                # then delete the first in-order successor node.
-                self.value = self._find_in_order_successor()
-                self.right = self.right.remove_value(self.value)
-                return self
+    By default values are placed on the ring using Python's built-in hash(), which is randomised per process for
+    strings and bytes. Pass a different hash_function - for instance one built on xxhash or FNV - if you need a
+    faster hash or ring positions that are stable across runs. It must map every value to an integer.
 
-        else:
+    Pass a best_match_cache_size, e.g. 4096, to remember up to that many recent best matches, which speeds up
+    workloads that keep looking up the same hot values. This is off by default, as remembering matches slows down
+    lookups that rarely repeat.
+    '''
 
-            self.left = self.left.remove_value(value) if self.left is not None else self.left
-            self.right = self.right.remove_value(value) if self.right is not None else self.right
-            return self
+    def __init__(self, value=None, hash_function=hash, best_match_cache_size=0):
 
-    def __repr__(self):
-        return "Node(value={0}, right={1}, left={2})".format(self.value, self.right, self.left)
+        self._hash = hash_function
 
-    def __str__(self):
-        return self.__repr__()
+        # sorted keys and their corresponding values. Lookups binary search these instead of walking a tree.
+        self._keys, self._values = [], []
 
-    def __contains__(self, value):
+        # values added since the last lookup, by key. These are merged into the sorted lists all at once, so that
+        # a burst of additions does not shift the lists along once per value.
+        self._pending = {}
 
-        key = hash(value)
-        if key == self.key:
-            return True
+        # best matches already looked up, by key, if enabled. Any change to the ring empties this, and once it holds
+        # best_match_cache_size matches they are all forgotten to make room.
+        self._best_match_cache_size = best_match_cache_size
+        self._best_matches = {} if best_match_cache_size else None
 
-        if key > self.key:
-           return False if self.right is None else value in self.right
-        
-        if key < self.key:
-           return False if self.left is None else value in self.left
+        if value is not None:
+            self.add_node(value)
 
-    def __iter__(self):
+    @classmethod
+    def build(cls, values, hash_function=hash, best_match_cache_size=0):
 
-        if self.left is not None:
-            for value in iter(self.left):
-                yield value
+        '''
+        Build a ring holding all of values at once. This hashes and sorts everything a single time rather than
+        inserting values one by one. As with add_node, only the first of several values sharing a key is kept.
+        '''
 
-        yield self.value
+        ring = cls(hash_function=hash_function, best_match_cache_size=best_match_cache_size)
 
-        if self.right is not None:
-            for value in iter(self.right):
-                yield value
+        # sorted() is stable, so the first value for each key sorts ahead of any later duplicates
+        for key, value in sorted(((hash_function(value), value) for value in values), key=itemgetter(0)):
 
+            if ring._keys and ring._keys[-1] == key:
+                continue
 
-class ConsistentHashRing(object):
+            ring._keys.append(key)
+            ring._values.append(value)
 
-    ''' 
-    A wrapper around the SubTree class that lets you manipulate the whole tree at once.
+        return ring
 
-    This class provides access to the root node, and enables you to search the tree
-    for the closest match to a value. Iteration and length methods return all stored 
-    values in the tree, however.
+    @property
+    def head(self):
 
-    Values added to this ConsistentHashRing _must_ be hashable. 
-    '''
+        '''
+        The root node of a balanced SubTree holding every value in the ring, or None if the ring is empty. A new 
+        tree is built from the sorted keys on every read, which is O(n) - it is a snapshot of the ring, so later 
+        changes to the ring do not show up in it, and changes made to it do not show up in the ring.
+        '''
 
-    def __init__(self, value=None):
-        self.head = None if value is None else SubTree(value)
+        self._flush()
+        return SubTree.from_sorted(self._values, self._keys)
 
     def add_node(self, value):
 
-        ''' Add a value to the tree as a whole. '''
+        ''' Add a value to the ring. '''
 
-        if self.head is None:
-           self.head = SubTree(value)
-        else:
-           self.head.add_child(value)
+        key = self._hash(value)
+        index = bisect_left(self._keys, key)
+
+        # duplicate keys are excluded
+        if key in self._pending or index < len(self._keys) and self._keys[index] == key:
+            return
+
+        self._pending[key] = value
+
+        if self._best_matches:
+            self._best_matches.clear()
 
     def remove_node(self, value):
 
-        ''' Remove a value from the tree. Only exact matches may be removed - values not in the tree are ignored. '''
+        ''' Remove a value from the ring. Only exact matches may be removed - values not in the tree are ignored. '''
+
+        key = self._hash(value)
+
+        if key in self._pending:
+            del self._pending[key]
+        else:
 
-        if self.head is None:
-            return 
+            index = bisect_left(self._keys, key)
 
-        self.head = self.head.remove_value(value)
+            if index == len(self._keys) or self._keys[index] != key:
+                return 
 
-    def find_best_match(self, value):
+            del self._keys[index]
+            del self._values[index]
+
+        if self._best_matches:
+            self._best_matches.clear()
+
+    def _flush(self):
+
+        ''' Merge any values added since the last lookup into the sorted key and value lists. '''
+
+        if not self._pending:
+            return
+
+        pending = sorted(self._pending.items(), key=itemgetter(0))
+        self._pending = {}
+
+        # each insertion shifts every later entry along, so once enough values are pending a single merge of the two
+        # sorted runs is cheaper. sorted() finds both runs and merges them in linear time.
+        if len(pending) * 128 < len(self._keys):
+
+            for key, value in pending:
+                index = bisect_left(self._keys, key)
+                self._keys.insert(index, key)
+                self._values.insert(index, value)
+
+        else:
+
+            merged = sorted(list(zip(self._keys, self._values)) + pending, key=itemgetter(0))
+            self._keys = [key for key, _ in merged]
+            self._values = [value for _, value in merged]
+
+    def find_best_match(self, value, candidates=1):
 
         '''
         Search for closest match - if exact value exists, it shall return that value, otherwise it will return the closest
@@ -196,61 +278,102 @@ class ConsistentHashRing(object):
 
         Note that 'closest match' here translates to first bigger value than value passed in as parameter here. If an exact
         match is found, it returns that. 
+
+        If candidates is greater than 1, that many consecutive values are taken from the ring starting at the closest match,
+        and the one with the highest rendezvous (HRW) score for value is returned instead. This spreads load more evenly
+        between neighbouring values. Note that removing a value can also remap lookups that chose one of its neighbours, 
+        as the next value along the ring joins their candidates and may score higher.
         '''
 
-        key = hash(value)
-        current_node = self.head
-        best_match, best_match_key = None, float("inf")
+        self._flush()
 
         # if tree is empty, return None
-        if not self.head:
+        if not self._keys:
             return None
 
-        # if tree is not empty, walk through the binary search tree, and update the best_match to reflect the closest but 
-        # larger value encountered.
+        # the first key not smaller than ours is the best match. If all keys are smaller, the index wraps around to the 
+        # smallest value in the ring, in line with the principles behind consistent hashing.
 
-        while current_node is not None:
-            
-            # exit if exact match is found, returning that value
-            if current_node.key == key:
-                return current_node.value
+        key = self._hash(value)
+        best_matches = self._best_matches
 
-            # if number is bigger, check if it is closer to our target value than the last number, and choose to update
-            # accordingly
-            if current_node.key > key:
+        if candidates <= 1 and best_matches and key in best_matches:
+            return best_matches[key]
 
-                best_match = current_node.value if abs(current_node.key - key) < abs(best_match_key - key) else best_match
-                best_match_key = hash(best_match)
+        index = bisect_left(self._keys, key)
+        size = len(self._values)
 
-                current_node = current_node.left
-                continue
+        if candidates <= 1:
 
-            if current_node.key < key:
-                current_node = current_node.right
-                continue
+            best_match = self._values[index % size]
 
-        # best_match can still be None if all values in the BST are smaller than the submitted value. In that case,
-        # we always return the smallest value in the BST, in line with the principles behind consistent hashing. 
+            if best_matches is not None:
+
+                if len(best_matches) >= self._best_match_cache_size:
+                    best_matches.clear()
+
+                best_matches[key] = best_match
 
-        if best_match:
             return best_match
-        else:
-            # will always return the smallest value in the BST
-            return self.head._find_minimum_subtree_child_value()
+
+        # every value in the ring is a distinct node, so the next candidate is always the next index along. Each
+        # candidate's key is already its hash, so it is scored straight from the sorted keys.
+        keys = self._keys
+        offsets = range(min(candidates, size))
+        best_offset = max(offsets, key=lambda offset: _rendezvous_score(keys[(index + offset) % size], key))
+        return self._values[(index + best_offset) % size]
+
+    def find_best_match_many(self, values):
+
+        '''
+        Batch version of find_best_match. Returns a list holding the best match for each value passed in, in the same 
+        order. If the tree is empty, every match is None.
+        '''
+
+        self._flush()
+        keys, ring_values, hash_function = self._keys, self._values, self._hash
+
+        if not keys:
+            return [None for _ in values]
+
+        size = len(keys)
+        return [ring_values[bisect_left(keys, hash_function(value)) % size] for value in values]
 
     def __iter__(self):
-        # generate an in-order traversal of the tree
-        return iter(self.head)
+        # the sorted values are already in ring order
+        self._flush()
+        return iter(self._values)
         
     def __repr__(self):
         return repr(self.head)
         
+    def __contains__(self, value):
+
+        key = self._hash(value)
+
+        if key in self._pending:
+            return True
+
+        index = bisect_left(self._keys, key)
+        return index < len(self._keys) and self._keys[index] == key
+
     def __len__(self):
 
-        ''' Note that this is O(n) operation, rather than a traditional O(1). '''
+        ''' The sorted and pending keys hold exactly one entry per stored value, so this is O(1). '''
 
-        return sum(1 for value in iter(self.head))
+        return len(self._keys) + len(self._pending)
 
     def __eq__(self, other):
 
-        return repr(self.head) == repr(other)
+        if not isinstance(other, ConsistentHashRing):
+            return NotImplemented
+
+        self._flush()
+        other._flush()
+
+        return self._keys == other._keys and self._values == other._values
+
+    def __ne__(self, other):
+
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
@@ -78,6 +78,9 @@ class StandardBehaviourTestCase(unittest.TestCase):
         self.assertIsNone(self.consistentRingWithSignedInputs.head)
         self.assertIsNone(self.consistentRingWithStringInputs.head)
 
+        self.assertEqual(len(self.consistentRingWithSignedInputs), 0)
+        self.assertEqual(len(self.consistentRingWithStringInputs), 0)
+
     def testcase_3(self):
 
         '''
@@ -110,6 +113,245 @@ class StandardBehaviourTestCase(unittest.TestCase):
         self.assertEqual(self.consistentRingWithSignedInputs.find_best_match(number_lower_than_all_numbers), self.test_number_range[0])
         
 
+    def testcase_4(self):
+
+        '''
+        Does batch lookup agree with looking up every value individually?
+        '''
+
+        self.assertEqual(self.consistentRingWithSignedInputs.find_best_match_many([1, 2]), [None, None])
+
+        for number in self.test_number_range:
+            self.consistentRingWithSignedInputs.add_node(number)
+
+        values_to_test = list(range(-30, 30))
+        expected = [self.consistentRingWithSignedInputs.find_best_match(value) for value in values_to_test]
+
+        self.assertEqual(self.consistentRingWithSignedInputs.find_best_match_many(values_to_test), expected)
+
+    def testcase_5(self):
+
+        '''
+        Does rendezvous selection pick consistently from the consecutive values after the closest match, and fall back to
+        the plain closest match when only one candidate is asked for?
+
+        Placing values on the ring by their own value makes scores deterministic, so known choices can be checked, along
+        with the property that removing a value outside a lookup's candidates never changes its choice.
+        '''
+
+        ring_values = list(range(0, 100, 10))
+        ring = ConsistentHashRing.build(ring_values, hash_function=lambda value: value)
+
+        known_choices = {(5, 3): 20, (35, 3): 60, (95, 3): 20, (42, 5): 80, (7, 2): 20, (61, 4): 0}
+
+        for (value, candidates), expected in known_choices.items():
+            self.assertEqual(ring.find_best_match(value, candidates=candidates), expected)
+
+        for value in range(100):
+
+            self.assertEqual(ring.find_best_match(value, candidates=1), ring.find_best_match(value))
+
+            closest_index = ring_values.index(ring.find_best_match(value))
+            nearby_values = [ring_values[(closest_index + offset) % len(ring_values)] for offset in range(3)]
+            choice = ring.find_best_match(value, candidates=3)
+
+            self.assertIn(choice, nearby_values)
+
+            for removed_value in ring_values:
+
+                if removed_value in nearby_values:
+                    continue
+
+                smaller_ring = ConsistentHashRing.build(ring_values, hash_function=lambda value: value)
+                smaller_ring.remove_node(removed_value)
+                self.assertEqual(smaller_ring.find_best_match(value, candidates=3), choice)
+
+        # asking for more candidates than there are values considers every value exactly once
+        self.assertIn(ring.find_best_match(0, candidates=1000), ring_values)
+
+        # values only hashable through the ring's own hash function can still be scored
+        ring_of_lists = ConsistentHashRing(hash_function=lambda value: hash(repr(value)))
+
+        for number in range(5):
+            ring_of_lists.add_node([number])
+
+        self.assertIn(ring_of_lists.find_best_match([3], candidates=2), [[number] for number in range(5)])
+
+    def testcase_6(self):
+
+        '''
+        Is a custom hash function used to place values on the ring?
+
+        Negating the built-in hash reverses the order of our signed inputs, so the in-order traversal and the
+        wrap-around match should both be reversed too.
+        '''
+
+        ring = ConsistentHashRing(hash_function=lambda value: -hash(value))
+
+        for number in self.test_number_range:
+            ring.add_node(number)
+
+        self.assertEqual(list(ring), self.test_number_range[::-1])
+        self.assertTrue(all(number in ring for number in self.test_number_range))
+        self.assertTrue(all(ring.head.contains_key(-hash(number)) for number in self.test_number_range))
+        self.assertNotIn(100, ring)
+
+        # the tree only knows keys, so it refuses to guess how a value hashes
+        self.assertRaises(TypeError, lambda: 0 in ring.head)
+        self.assertEqual(ring.find_best_match(self.test_number_range[0] - 1), self.test_number_range[-1])
+
+        ring.remove_node(self.test_number_range[-1])
+        self.assertEqual(list(ring), self.test_number_range[-2::-1])
+
+    def testcase_7(self):
+
+        '''
+        Is the tree handed out by head balanced when values arrive in hash order?
+
+        Inserting these one by one into a plain binary search tree would give a linked list of depth 1000. Built from
+        the sorted keys, no path should be longer than log2(1000) + 1 nodes.
+        '''
+
+        for number in range(1000):
+            self.consistentRingWithSignedInputs.add_node(number)
+
+        depth, level = 0, [self.consistentRingWithSignedInputs.head]
+
+        while level:
+            depth += 1
+            level = [child for node in level for child in (node.left, node.right) if child is not None]
+
+        self.assertLessEqual(depth, 10)
+        self.assertEqual(list(self.consistentRingWithSignedInputs.head), list(range(1000)))
+
+    def testcase_8(self):
+
+        '''
+        Are rings holding the same values equal, regardless of insertion order?
+        '''
+
+        for number in self.test_number_range:
+            self.consistentRingWithSignedInputs.add_node(number)
+
+        ring_in_reverse = ConsistentHashRing()
+
+        for number in reversed(self.test_number_range):
+            ring_in_reverse.add_node(number)
+
+        self.assertEqual(self.consistentRingWithSignedInputs, ring_in_reverse)
+
+        ring_in_reverse.remove_node(0)
+        self.assertNotEqual(self.consistentRingWithSignedInputs, ring_in_reverse)
+        self.assertNotEqual(self.consistentRingWithSignedInputs, self.test_number_range)
+
+    def testcase_9(self):
+
+        '''
+        Does building a ring in bulk give the same ring as adding values one by one, including for duplicate keys?
+        '''
+
+        for number in self.test_number_range:
+            self.consistentRingWithSignedInputs.add_node(number)
+
+        shuffled_numbers = self.test_number_range + [-1]
+        random.shuffle(shuffled_numbers)
+
+        built_ring = ConsistentHashRing.build(shuffled_numbers + self.test_number_range)
+
+        # -1 and -2 share a hash, so whichever came first in the shuffled list is kept
+        expected_values = [-1 if number == -2 and shuffled_numbers.index(-1) < shuffled_numbers.index(-2) else number 
+                           for number in self.test_number_range]
+
+        self.assertEqual(list(built_ring), expected_values)
+        self.assertEqual(list(built_ring.head), expected_values)
+
+        built_ring.remove_node(0)
+        built_ring.add_node(100)
+        self.assertEqual(list(built_ring.head), list(built_ring))
+
+        self.assertIsNone(ConsistentHashRing.build([]).head)
+
+    def testcase_10(self):
+
+        '''
+        Are values added between lookups picked up correctly, whether a few are added to a large ring or many at once,
+        and can they be removed again before the next lookup?
+        '''
+
+        ring = ConsistentHashRing.build(range(0, 2000, 2))
+
+        for number in (1, 3, 5, 7):
+            ring.add_node(number)
+
+        ring.remove_node(5)
+        ring.remove_node(6)
+
+        self.assertEqual(len(ring), 1002)
+        self.assertEqual(ring.find_best_match(4), 4)
+        self.assertEqual(ring.find_best_match(5), 7)
+        self.assertEqual(ring.find_best_match(6), 7)
+
+        for number in range(2001, 2400, 2):
+            ring.add_node(number)
+
+        expected_values = sorted((set(range(0, 2000, 2)) | set((1, 3, 7)) | set(range(2001, 2400, 2))) - set((6,)))
+        self.assertEqual(list(ring), expected_values)
+        self.assertEqual(list(ring.head), expected_values)
+
+    def testcase_11(self):
+
+        '''
+        When best matches are remembered, do they stay correct as the ring changes? Is remembering them set per ring?
+        '''
+
+        ring = ConsistentHashRing(best_match_cache_size=4096)
+
+        for number in (0, 10, 20):
+            ring.add_node(number)
+            self.consistentRingWithSignedInputs.add_node(number)
+
+        self.assertEqual(ring.find_best_match(5), 10)
+        self.assertEqual(ring.find_best_match(5), 10)
+
+        ring.add_node(7)
+        self.assertEqual(ring.find_best_match(5), 7)
+
+        ring.remove_node(7)
+        self.assertEqual(ring.find_best_match(5), 10)
+        self.assertEqual(ring.find_best_match(25), 0)
+
+        # the ring built without a cache size is unaffected
+        self.assertEqual(self.consistentRingWithSignedInputs.find_best_match(5), 10)
+
+        # a cache smaller than the number of distinct lookups still gives the right answers as it makes room
+        built_ring = ConsistentHashRing.build((0, 10, 20), best_match_cache_size=2)
+
+        for value in (5, 15, 25, 5, 15, 25):
+            self.assertEqual(built_ring.find_best_match(value), self.consistentRingWithSignedInputs.find_best_match(value))
+
+    def testcase_12(self):
+
+        '''
+        Is the tree handed out by head a snapshot, so that changing it affects neither the ring nor its repr?
+        '''
+
+        ring = self.consistentRingWithSignedInputs
+
+        for number in (1, 2, 3):
+            ring.add_node(number)
+
+        original_repr = repr(ring)
+
+        ring.head.right.right = None
+        ring.head.value = 99
+
+        self.assertEqual(repr(ring), original_repr)
+        self.assertEqual(list(ring.head), [1, 2, 3])
+        self.assertNotIn(99, ring)
+
+        ring.add_node(4)
+        self.assertEqual(list(ring.head), [1, 2, 3, 4])
+
     def tearDown(self):
         
         self.consistentRingWithSignedInputs = None